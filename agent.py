@@ -1,16 +1,36 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import logging
-from dataclasses import dataclass
-from typing import Literal
-
+import random
+import re
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Literal, Union
+
+import httpx
+import openai
 from openai import AsyncOpenAI
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    UserPromptPart,
+)
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
+from pydantic_ai.result import StreamedRunResult
+from pydantic_ai.settings import ModelSettings
 
 from .settings import Settings
 
@@ -19,13 +39,45 @@ logger = logging.getLogger("placementsprint.agent")
 
 Mode = Literal["auto", "plan", "resume", "interview"]
 
+# Static prompt text lives at module scope so every request for a given mode
+# starts with a byte-identical system message (system context, then the mode
+# instruction) ahead of the history, which lets OpenRouter/OpenAI prefix caching hit.
+SYSTEM_CONTEXT = (
+    "You are PlacementSprint, a practical placement-prep agent.\n"
+    "You must be concise, structured, and action-oriented.\n"
+    "If the prompt contains a section starting with 'RESUME_CONTEXT:' treat it as the user's resume text;\n"
+    "the user's actual request then follows 'USER_MESSAGE:'.\n"
+    "Do not repeat the resume verbatim; extract only relevant facts.\n"
+    "Output MUST be valid per the schema (reply_markdown, action_items, follow_up_questions, warnings).\n"
+    "If inputs are missing (role, deadline, skills), ask focused follow-up questions.\n"
+)
+
+MODE_INSTRUCTIONS: dict[Mode, str] = {
+    "plan": "Generate a timeboxed plan (today + next 7 days). Include action_items.",
+    "resume": "Improve resume bullets based on user info/JD; provide 4-8 bullets and 3 fixes.",
+    "interview": "Generate an interview prep set: 10 questions + what a strong answer includes.",
+    "auto": "Decide whether plan/resume/interview is best, then proceed.",
+}
+
+FALLBACK_WARNING = "Primary model failed; response generated with fallback model."
+
+# Leading system message per mode, built once at import rather than per request.
+_MODE_PROMPTS: dict[Mode, str] = {
+    mode: f"{SYSTEM_CONTEXT}\nMODE: {mode}\nMODE_INSTRUCTION: {instruction}"
+    for mode, instruction in MODE_INSTRUCTIONS.items()
+}
+
 
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     role: Literal["user", "assistant"]
     content: str = Field(min_length=1, max_length=8000)
 
 
 class ActionItem(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     title: str = Field(min_length=1, max_length=140)
     why: str = Field(min_length=1, max_length=200)
     eta_minutes: int = Field(ge=1, le=240)
@@ -39,59 +91,258 @@ class AgentResponse(BaseModel):
     warnings: list[str] = Field(default_factory=list)
 
 
+# Events yielded by Orchestrator.respond_stream: newly generated reply_markdown
+# text ("delta"), the full reply_markdown when a partial parse rewrote earlier
+# text ("snapshot"), notices for the client, and the final validated response.
+StreamEvent = Union[
+    tuple[Literal["delta"], str],
+    tuple[Literal["snapshot"], str],
+    tuple[Literal["warning"], str],
+    tuple[Literal["done"], AgentResponse],
+]
+
+
 class Intent(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     intent: Mode
     confidence: float = Field(ge=0.0, le=1.0)
     rationale: str = Field(min_length=1, max_length=300)
 
 
-def _build_openrouter_model(settings: Settings, model_id: str) -> OpenAIChatModel:
+_INTENT_DIRECT_SYSTEM = (
+    "Classify the user's intent. Reply only with JSON matching {intent, confidence, rationale}. "
+    "intent is one of: auto, plan, resume, interview. confidence is 0-1. rationale is one short sentence."
+)
+
+_INTENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "Intent", "schema": Intent.model_json_schema()},
+}
+
+# Only route to OpenRouter providers that honour response_format; otherwise a
+# provider may ignore the schema and reply with free text.
+_INTENT_DIRECT_EXTRA_BODY = {"provider": {"require_parameters": True}}
+# What OpenRouter answers when no endpoint for the model accepts the request shape.
+_UNSUPPORTED_FORMAT_ERRORS = (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)
+
+
+# Obvious cases skip the LLM classifier entirely. Only used when exactly one
+# category matches; anything ambiguous still goes to classify_intent.
+_KEYWORD_INTENTS: dict[Mode, re.Pattern[str]] = {
+    "resume": re.compile(r"\b(resume|cv|bullets?)\b", re.I),
+    "interview": re.compile(r"\b(interviews?|behaviou?ral|leetcode|system design)\b", re.I),
+    "plan": re.compile(r"\b(plan|schedule|week|deadline|timeline)\b", re.I),
+}
+
+
+# The frontend sends "RESUME_CONTEXT:\n<resume>\n\nUSER_MESSAGE:\n<request>" once a
+# resume is loaded.
+RESUME_CONTEXT_PREFIX = "RESUME_CONTEXT:"
+USER_MESSAGE_MARKER = "\n\nUSER_MESSAGE:\n"
+
+
+def _user_request_text(text: str) -> str | None:
+    # The user's own request without the resume block; None if it can't be separated
+    # (e.g. messages from an older frontend that had no USER_MESSAGE marker).
+    if not text.startswith(RESUME_CONTEXT_PREFIX):
+        return text
+    _, sep, request = text.rpartition(USER_MESSAGE_MARKER)
+    return request if sep else None
+
+
+def _keyword_intent(latest: str) -> Mode | None:
+    # Match only the user's request: the resume text would match every pattern.
+    text = _user_request_text(latest)
+    if text is None:
+        return None
+    matches = [mode for mode, pattern in _KEYWORD_INTENTS.items() if pattern.search(text)]
+    return matches[0] if len(matches) == 1 else None
+
+
+_ROLE_TO_MESSAGE: dict[str, Callable[[str], ModelMessage]] = {
+    "user": lambda text: ModelRequest(parts=[UserPromptPart(content=text)]),
+    "assistant": lambda text: ModelResponse(parts=[TextPart(content=text)]),
+}
+
+
+# Optional cap on concurrent upstream model calls for the current context (set
+# by limit_upstream_calls; tasks created inside inherit it).
+_upstream_limit: ContextVar[asyncio.Semaphore | None] = ContextVar("upstream_limit", default=None)
+
+
+@contextmanager
+def limit_upstream_calls(limit: int) -> Iterator[None]:
+    token = _upstream_limit.set(asyncio.Semaphore(limit))
+    try:
+        yield
+    finally:
+        _upstream_limit.reset(token)
+
+
+@asynccontextmanager
+async def _upstream_slot():
+    sem = _upstream_limit.get()
+    if sem is None:
+        yield
+        return
+    async with sem:
+        yield
+
+
+_RETRIABLE_STATUS = {408, 409, 429}
+# openai.APITimeoutError is a subclass of APIConnectionError.
+_TRANSIENT_ERRORS = (httpx.TransportError, openai.APIConnectionError)
+
+
+def _is_retriable(e: Exception) -> bool:
+    # Network trouble, timeouts, rate limits and 5xx are worth another try;
+    # auth/validation errors and schema mismatches are not. pydantic-ai wraps
+    # connection errors and timeouts in ModelAPIError, so check the cause too.
+    if isinstance(e, _TRANSIENT_ERRORS) or isinstance(e.__cause__, _TRANSIENT_ERRORS):
+        return True
+    status = e.status_code if isinstance(e, (ModelHTTPError, openai.APIStatusError)) else None
+    return status is not None and (status in _RETRIABLE_STATUS or status >= 500)
+
+
+def _retry_after_seconds(e: Exception, max_s: float = 30.0) -> float | None:
+    # pydantic-ai wraps openai.APIStatusError in ModelHTTPError; the headers live on the original.
+    response = getattr(e, "response", None) or getattr(e.__cause__, "response", None)
+    if response is None:
+        return None
+    try:
+        return min(float(response.headers.get("retry-after")), max_s)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cache_settings(model_id: str) -> ModelSettings | None:
+    # Anthropic models on OpenRouter only cache when explicitly asked to.
+    if model_id.startswith("anthropic/"):
+        return ModelSettings(extra_body={"cache_control": {"type": "ephemeral"}})
+    return None
+
+
+def build_openrouter_client(settings: Settings) -> AsyncOpenAI:
     # OpenRouter is OpenAI-compatible and uses base_url https://openrouter.ai/api/v1 :contentReference[oaicite:4]{index=4}
+    # One client (and one connection pool) is shared by the primary and fallback models.
     headers: dict[str, str] = {}
     if settings.site_url:
         headers["HTTP-Referer"] = settings.site_url
     if settings.app_name:
         headers["X-Title"] = settings.app_name
 
-    client = AsyncOpenAI(
+    return AsyncOpenAI(
         api_key=settings.openrouter_api_key,
         base_url="https://openrouter.ai/api/v1",
         default_headers=headers or None,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        ),
     )
+
+
+def _build_openrouter_model(client: AsyncOpenAI, model_id: str) -> OpenAIChatModel:
     provider = OpenAIProvider(openai_client=client)
     return OpenAIChatModel(model_id, provider=provider)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Orchestrator:
     intent_agent_primary: Agent[None, Intent]
     intent_agent_fallback: Agent[None, Intent]
     main_agent_primary: Agent[None, AgentResponse]
     main_agent_fallback: Agent[None, AgentResponse]
+    client: AsyncOpenAI
+    intent_model_id: str
+    intent_cache_size: int = 1024
+    _intent_cache: OrderedDict[str, Intent] = field(default_factory=OrderedDict, init=False, repr=False)
+    _intent_cache_lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False, repr=False)
+    # Models that rejected json_schema output; the direct intent call is skipped
+    # for these instead of paying a failed round trip on every turn.
+    _json_schema_unsupported: set[str] = field(default_factory=set, init=False, repr=False)
 
     async def _run_with_retries(self, run_fn, *, max_attempts: int = 3):
-        last_err: Exception | None = None
         for attempt in range(1, max_attempts + 1):
             try:
-                return await run_fn()
+                async with _upstream_slot():
+                    return await run_fn()
             except Exception as e:
-                last_err = e
-                sleep_s = min(2.0 * attempt, 6.0)
+                if attempt == max_attempts or not _is_retriable(e):
+                    raise
+                # Full jitter on an exponential schedule, unless the provider said when to come back.
+                sleep_s = _retry_after_seconds(e)
+                if sleep_s is None:
+                    sleep_s = random.uniform(0, min(8.0, 0.5 * 2**attempt))
                 logger.warning("attempt=%s failed: %s; retrying in %.1fs", attempt, repr(e), sleep_s)
                 await asyncio.sleep(sleep_s)
-        assert last_err is not None
-        raise last_err
 
     @staticmethod
-    def _format_history(messages: list[ChatMessage], keep_last: int = 12) -> str:
-        trimmed = messages[-keep_last:]
-        lines = []
-        for m in trimmed:
-            role = "USER" if m.role == "user" else "ASSISTANT"
-            lines.append(f"{role}: {m.content.strip()}")
-        return "\n".join(lines)
+    def _build_message_history(
+        messages: list[ChatMessage], mode: Mode, keep_last: int = 12
+    ) -> list[ModelMessage]:
+        # System context + mode instruction first (static per mode), then role-tagged
+        # turns, so the request prefix stays stable as the conversation grows.
+        return [
+            ModelRequest(parts=[SystemPromptPart(content=_MODE_PROMPTS[mode])]),
+            *(_ROLE_TO_MESSAGE[m.role](m.content.strip()) for m in messages[-keep_last:]),
+        ]
+
+    @staticmethod
+    def _intent_cache_key(text: str) -> str:
+        # Hash the whole message: the frontend prefixes every turn with the
+        # resume, so a truncated key would collide across different requests.
+        normalized = " ".join(text.lower().split())
+        return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
 
     async def classify_intent(self, latest_user_text: str) -> Intent:
+        key = self._intent_cache_key(latest_user_text)
+        cached = self._intent_cache.get(key)
+        if cached is not None:
+            self._intent_cache.move_to_end(key)
+            return cached
+
+        intent = await self._classify_intent_uncached(latest_user_text)
+        async with self._intent_cache_lock:
+            self._intent_cache[key] = intent
+            if len(self._intent_cache) > self.intent_cache_size:
+                self._intent_cache.popitem(last=False)
+        return intent
+
+    async def classify_intent_direct(self, latest_user_text: str) -> Intent:
+        # Single-shot JSON-schema completion on the shared client: no agent
+        # tool loop, one validation pass.
+        async with _upstream_slot():
+            r = await self.client.chat.completions.create(
+                model=self.intent_model_id,
+                messages=[
+                    {"role": "system", "content": _INTENT_DIRECT_SYSTEM},
+                    {"role": "user", "content": latest_user_text},
+                ],
+                response_format=_INTENT_RESPONSE_FORMAT,
+                extra_body=_INTENT_DIRECT_EXTRA_BODY,
+            )
+        content = r.choices[0].message.content if r.choices else None
+        if not content:
+            raise ValueError("empty intent response")
+        return Intent.model_validate_json(content)
+
+    async def _classify_intent_uncached(self, latest_user_text: str) -> Intent:
+        # The direct call only targets the primary model; provider fallback is
+        # left to the agent path below.
+        if self.intent_model_id not in self._json_schema_unsupported:
+            try:
+                return await self.classify_intent_direct(latest_user_text)
+            except _UNSUPPORTED_FORMAT_ERRORS as e:
+                self._json_schema_unsupported.add(self.intent_model_id)
+                logger.warning(
+                    "model=%s rejected json_schema intent request: %s; using agent path from now on",
+                    self.intent_model_id,
+                    repr(e),
+                )
+            except Exception as e:
+                logger.warning("direct intent classification failed: %s; using agent path", repr(e))
+
         prompt = (
             "Classify the user's intent into one of: auto, plan, resume, interview.\n"
             "Return the intent with confidence and a short rationale.\n\n"
@@ -112,66 +363,162 @@ class Orchestrator:
             logger.exception("intent primary failed; switching to fallback")
             return await self._run_with_retries(fallback)
 
-    async def respond(self, messages: list[ChatMessage], mode: Mode) -> AgentResponse:
-        if not messages or messages[-1].role != "user":
-            raise ValueError("Last message must be from the user.")
-
-        history = self._format_history(messages)
-        latest = messages[-1].content.strip()
-
-        resolved_mode = mode
-        if mode == "auto":
-            intent = await self.classify_intent(latest)
-            # If low confidence, keep auto; otherwise follow classifier
-            if intent.confidence >= 0.55:
-                resolved_mode = intent.intent
-
-        system_context = (
-            "You are PlacementSprint, a practical placement-prep agent.\n"
-            "You must be concise, structured, and action-oriented.\n"
-            "If the prompt contains a section starting with 'RESUME_CONTEXT:' treat it as the user's resume text.\n"
-            "Do not repeat the resume verbatim; extract only relevant facts.\n"
-            "Output MUST be valid per the schema (reply_markdown, action_items, follow_up_questions, warnings).\n"
-            "If inputs are missing (role, deadline, skills), ask focused follow-up questions.\n"
-        )
-
-        mode_instruction = {
-            "plan": "Generate a timeboxed plan (today + next 7 days). Include action_items.",
-            "resume": "Improve resume bullets based on user info/JD; provide 4-8 bullets and 3 fixes.",
-            "interview": "Generate an interview prep set: 10 questions + what a strong answer includes.",
-            "auto": "Decide whether plan/resume/interview is best, then proceed.",
-        }[resolved_mode]
-
-        prompt = (
-            f"{system_context}\n"
-            f"MODE: {resolved_mode}\n"
-            f"MODE_INSTRUCTION: {mode_instruction}\n\n"
-            "CONVERSATION_HISTORY:\n"
-            f"{history}\n\n"
-            "USER_LATEST:\n"
-            f"{latest}\n"
-        )
+    async def _run_main(self, resolved_mode: Mode, messages: list[ChatMessage], latest: str) -> AgentResponse:
+        history = self._build_message_history(messages[:-1], resolved_mode)
 
         async def primary():
-            r = await self.main_agent_primary.run(prompt)
+            r = await self.main_agent_primary.run(latest, message_history=history)
             return r.output
 
+        try:
+            return await self._run_with_retries(primary)
+        except Exception:
+            logger.exception("main primary failed; switching to fallback")
+            resp = await self._run_fallback(resolved_mode, messages, latest)
+            resp.warnings.append(FALLBACK_WARNING)
+            return resp
+
+    async def _run_fallback(self, resolved_mode: Mode, messages: list[ChatMessage], latest: str) -> AgentResponse:
+        history = self._build_message_history(messages[:-1], resolved_mode)
+
         async def fallback():
-            r = await self.main_agent_fallback.run(prompt)
+            r = await self.main_agent_fallback.run(latest, message_history=history)
             return r.output
 
+        return await self._run_with_retries(fallback)
+
+    @staticmethod
+    async def _open_stream(
+        agent: Agent[None, AgentResponse], latest: str, history: list[ModelMessage]
+    ) -> tuple[AsyncExitStack, StreamedRunResult[None, AgentResponse]]:
+        # Entering run_stream sends the request, so provider errors surface here
+        # (where they can still be retried) rather than mid-stream.
+        stack = AsyncExitStack()
         try:
-            return await self._run_with_retries(primary)
+            result = await stack.enter_async_context(agent.run_stream(latest, message_history=history))
+        except BaseException:
+            await stack.aclose()
+            raise
+        return stack, result
+
+    async def _open_main_stream(
+        self, resolved_mode: Mode, messages: list[ChatMessage], latest: str
+    ) -> tuple[AsyncExitStack, StreamedRunResult[None, AgentResponse], str | None]:
+        history = self._build_message_history(messages[:-1], resolved_mode)
+        try:
+            stack, result = await self._run_with_retries(
+                lambda: self._open_stream(self.main_agent_primary, latest, history)
+            )
         except Exception:
             logger.exception("main primary failed; switching to fallback")
-            resp = await self._run_with_retries(fallback)
-            resp.warnings.append("Primary model failed; response generated with fallback model.")
-            return resp
+            stack, result = await self._run_with_retries(
+                lambda: self._open_stream(self.main_agent_fallback, latest, history)
+            )
+            return stack, result, FALLBACK_WARNING
+        return stack, result, None
+
+    @staticmethod
+    def _latest_user_text(messages: list[ChatMessage]) -> str:
+        if not messages or messages[-1].role != "user":
+            raise ValueError("Last message must be from the user.")
+        return messages[-1].content.strip()
+
+    @staticmethod
+    def _fast_mode(mode: Mode, latest: str) -> Mode:
+        # Explicit modes and obvious keyword matches never need the classifier.
+        if mode == "auto":
+            return _keyword_intent(latest) or "auto"
+        return mode
+
+    async def _classified_mode(self, latest: str) -> Mode:
+        intent = await self.classify_intent(latest)
+        # If low confidence, keep auto; otherwise follow classifier
+        return intent.intent if intent.confidence >= 0.55 else "auto"
+
+    async def respond_stream(self, messages: list[ChatMessage], mode: Mode) -> AsyncIterator[StreamEvent]:
+        latest = self._latest_user_text(messages)
+        mode = self._fast_mode(mode, latest)
+
+        if mode != "auto":
+            stack, result, warning = await self._open_main_stream(mode, messages, latest)
+        else:
+            # Classify while the auto-mode stream is being opened. The stream has
+            # to be entered and exited in this task (pydantic-ai keeps context
+            # vars across it), so it is the classifier that runs alongside.
+            intent_task = asyncio.create_task(self._classified_mode(latest))
+            try:
+                stack, result, warning = await self._open_main_stream("auto", messages, latest)
+            except BaseException:
+                _discard_task(intent_task)
+                raise
+            try:
+                resolved_mode = await intent_task
+            except BaseException:
+                await stack.aclose()
+                raise
+            if resolved_mode != "auto":
+                await stack.aclose()
+                stack, result, warning = await self._open_main_stream(resolved_mode, messages, latest)
+                mode = resolved_mode
+
+        try:
+            async with stack:
+                sent = ""
+                async for partial in result.stream_output(debounce_by=0.1):
+                    text = partial.reply_markdown
+                    if text.startswith(sent):
+                        if len(text) > len(sent):
+                            yield ("delta", text[len(sent):])
+                    else:
+                        yield ("snapshot", text)
+                    sent = text
+                resp = await result.get_output()
+        except Exception:
+            # The primary can still fail after the stream opened (a dropped
+            # connection or output that fails validation). Rerun on the fallback
+            # like respond() does, and replace whatever was already streamed.
+            if warning:
+                raise
+            logger.exception("main primary stream failed; switching to fallback")
+            resp = await self._run_fallback(mode, messages, latest)
+            warning = FALLBACK_WARNING
+            yield ("snapshot", resp.reply_markdown)
+
+        if warning:
+            resp.warnings.append(warning)
+            yield ("warning", warning)
+        yield ("done", resp)
+
+    async def respond(self, messages: list[ChatMessage], mode: Mode) -> AgentResponse:
+        latest = self._latest_user_text(messages)
+        mode = self._fast_mode(mode, latest)
+        if mode != "auto":
+            return await self._run_main(mode, messages, latest)
+
+        # Speculatively run the main agent in auto mode while the intent is
+        # classified; it is only discarded if the classifier picks another mode.
+        main_task = asyncio.create_task(self._run_main("auto", messages, latest))
+        try:
+            resolved_mode = await self._classified_mode(latest)
+            if resolved_mode == "auto":
+                return await main_task
+        finally:
+            _discard_task(main_task)
+
+        return await self._run_main(resolved_mode, messages, latest)
+
+
+def _discard_task(task: asyncio.Task) -> None:
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        # Retrieve a discarded failure so the loop doesn't log it as unhandled.
+        task.exception()
 
 
-def build_orchestrator(settings: Settings) -> Orchestrator:
-    primary_model = _build_openrouter_model(settings, settings.openrouter_model)
-    fallback_model = _build_openrouter_model(settings, settings.openrouter_fallback_model)
+def build_orchestrator(settings: Settings, client: AsyncOpenAI) -> Orchestrator:
+    primary_model = _build_openrouter_model(client, settings.openrouter_model)
+    fallback_model = _build_openrouter_model(client, settings.openrouter_fallback_model)
 
     # PydanticAI uses output_type for structured outputs (not result_type). :contentReference[oaicite:5]{index=5}
     intent_agent_primary = Agent(
@@ -187,13 +534,13 @@ def build_orchestrator(settings: Settings) -> Orchestrator:
 
     main_agent_primary = Agent(
         model=primary_model,
-        instructions="You generate the final response as PlacementSprint.",
         output_type=AgentResponse,
+        model_settings=_cache_settings(settings.openrouter_model),
     )
     main_agent_fallback = Agent(
         model=fallback_model,
-        instructions="You generate the final response as PlacementSprint.",
         output_type=AgentResponse,
+        model_settings=_cache_settings(settings.openrouter_fallback_model),
     )
 
     return Orchestrator(
@@ -201,4 +548,6 @@ def build_orchestrator(settings: Settings) -> Orchestrator:
         intent_agent_fallback=intent_agent_fallback,
         main_agent_primary=main_agent_primary,
         main_agent_fallback=main_agent_fallback,
+        client=client,
+        intent_model_id=settings.openrouter_model,
     )
@@ -117,6 +117,54 @@ async function uploadResume(file) {
   }
 }
 
+function formatReply(data) {
+  const parts = [];
+  parts.push(data.reply_markdown || "");
+
+  if (Array.isArray(data.action_items) && data.action_items.length) {
+    parts.push("\n\n---\n\n### Action items\n");
+    for (const a of data.action_items) {
+      parts.push(`- **${a.title}** _(ETA ${a.eta_minutes}m, ${a.priority})_: ${a.why}`);
+    }
+  }
+
+  if (Array.isArray(data.follow_up_questions) && data.follow_up_questions.length) {
+    parts.push("\n\n---\n\n### Quick questions\n");
+    for (const q of data.follow_up_questions) parts.push(`- ${q}`);
+  }
+
+  if (Array.isArray(data.warnings) && data.warnings.length) {
+    parts.push("\n\n---\n\n### Notes\n");
+    for (const w of data.warnings) parts.push(`- ${w}`);
+  }
+
+  return parts.join("\n");
+}
+
+// Minimal SSE reader for fetch() responses (EventSource can't POST).
+async function readEvents(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf("\n\n")) !== -1) {
+      const frame = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = "message";
+      let data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : null);
+    }
+  }
+}
+
 async function send() {
   const text = elInput.value.trim();
   if (!text) return;
@@ -125,7 +173,7 @@ async function send() {
   elStatus.textContent = "Thinking...";
 
   const resumePrefix = (resumeText && resumeText.trim().length > 0)
-    ? `RESUME_CONTEXT:\n${resumeText}\n\n`
+    ? `RESUME_CONTEXT:\n${resumeText}\n\nUSER_MESSAGE:\n`
     : "";
 
   // 1) Add the user message
@@ -146,7 +194,7 @@ async function send() {
   try {
     const res = await fetch("/api/chat", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
       body: JSON.stringify(payload),
     });
 
@@ -155,29 +203,31 @@ async function send() {
       throw new Error(err?.detail || `Request failed (${res.status})`);
     }
 
-    const data = await res.json();
-
-    const parts = [];
-    parts.push(data.reply_markdown || "");
-
-    if (Array.isArray(data.action_items) && data.action_items.length) {
-      parts.push("\n\n---\n\n### Action items\n");
-      for (const a of data.action_items) {
-        parts.push(`- **${a.title}** _(ETA ${a.eta_minutes}m, ${a.priority})_: ${a.why}`);
-      }
-    }
-
-    if (Array.isArray(data.follow_up_questions) && data.follow_up_questions.length) {
-      parts.push("\n\n---\n\n### Quick questions\n");
-      for (const q of data.follow_up_questions) parts.push(`- ${q}`);
-    }
-
-    if (Array.isArray(data.warnings) && data.warnings.length) {
-      parts.push("\n\n---\n\n### Notes\n");
-      for (const w of data.warnings) parts.push(`- ${w}`);
+    let data = null;
+    if ((res.headers.get("content-type") || "").includes("text/event-stream")) {
+      elStatus.textContent = "Writing...";
+      let streamed = "";
+      await readEvents(res, (event, payload) => {
+        if (event === "delta" || event === "snapshot") {
+          // delta appends new text; snapshot replaces the whole reply so far
+          const text = payload?.reply_markdown || "";
+          streamed = event === "delta" ? streamed + text : text;
+          if (streamed) {
+            messages[messages.length - 1] = { role: "assistant", content: streamed };
+            render();
+          }
+        } else if (event === "done") {
+          data = payload;
+        } else if (event === "error") {
+          throw new Error(payload?.detail || "Request failed");
+        }
+      });
+      if (!data) throw new Error("Response ended early. Try again.");
+    } else {
+      data = await res.json();
     }
 
-    messages[messages.length - 1] = { role: "assistant", content: parts.join("\n") };
+    messages[messages.length - 1] = { role: "assistant", content: formatReply(data) };
     saveState(messages);
     elStatus.textContent = "Done.";
   } catch (e) {
@@ -1,20 +1,38 @@
 from __future__ import annotations
 from fastapi import UploadFile, File
-from pypdf import PdfReader
+import pypdfium2 as pdfium
 import docx
+from docx.oxml.ns import qn
+import asyncio
+import functools
+import hashlib
 import io
+import json
 import logging
+import threading
 import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
+from time import perf_counter_ns
 from typing import Literal
 import os
 from fastapi.staticfiles import StaticFiles
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
-from .agent import AgentResponse, ChatMessage, Mode, build_orchestrator
-from .settings import Settings
+from openai import AsyncOpenAI
+
+from .agent import (
+    AgentResponse,
+    ChatMessage,
+    Mode,
+    Orchestrator,
+    build_openrouter_client,
+    build_orchestrator,
+    limit_upstream_calls,
+)
+from .settings import get_settings
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,14 +52,37 @@ class ApiError(BaseModel):
     request_id: str | None = None
 
 
+class ChatBatchRequest(BaseModel):
+    items: list[ChatRequest] = Field(min_length=1, max_length=16)
+
+
+CHAT_BATCH_CONCURRENCY = 8
+
+
+@functools.lru_cache(maxsize=1)
+def _get_openrouter_client() -> AsyncOpenAI:
+    return build_openrouter_client(get_settings())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_orchestrator() -> Orchestrator:
+    # Built on first chat rather than at startup, so cold starts that only serve
+    # uploads/health skip Agent construction; cached for warm invocations.
+    return build_orchestrator(get_settings(), _get_openrouter_client())
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Vercel recommends lifespan for startup logic. :contentReference[oaicite:6]{index=6}
-    settings = Settings()
+    settings = get_settings()
     app.state.settings = settings
-    app.state.orchestrator = build_orchestrator(settings)
+    app.state.resume_cache = OrderedDict()
     logger.info("startup ok (model=%s fallback=%s)", settings.openrouter_model, settings.openrouter_fallback_model)
     yield
+    if _get_openrouter_client.cache_info().currsize:
+        await _get_openrouter_client().close()
+        _get_orchestrator.cache_clear()
+        _get_openrouter_client.cache_clear()
     logger.info("shutdown")
 
 MAX_RESUME_BYTES = 2 * 1024 * 1024  # 2 MB
@@ -50,29 +91,77 @@ ALLOWED_RESUME_TYPES = {
     "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
 }
 
+MAX_RESUME_CHARS = 12000
+RESUME_CACHE_SIZE = 256
+RESUME_CACHE_TTL_S = 3600.0
+
+ResumeCacheKey = tuple[str, bytes]  # (kind, blake2b digest of the upload)
+
+def _resume_cache_get(cache: OrderedDict[ResumeCacheKey, tuple[float, str]], key: ResumeCacheKey) -> str | None:
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    expires_at, text = entry
+    if expires_at < time.monotonic():
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return text
+
+def _resume_cache_put(cache: OrderedDict[ResumeCacheKey, tuple[float, str]], key: ResumeCacheKey, text: str) -> None:
+    cache[key] = (time.monotonic() + RESUME_CACHE_TTL_S, text)
+    cache.move_to_end(key)
+    if len(cache) > RESUME_CACHE_SIZE:
+        cache.popitem(last=False)
+
 def _clean_text(s: str) -> str:
     s = s.replace("\x00", "").strip()
     # Keep it bounded so it doesn't explode tokens
-    if len(s) > 12000:
-        s = s[:12000] + "\n\n[Truncated resume text to 12k chars]"
+    if len(s) > MAX_RESUME_CHARS:
+        s = s[:MAX_RESUME_CHARS] + "\n\n[Truncated resume text to 12k chars]"
     return s
 
-def _extract_pdf_text(data: bytes) -> str:
-    reader = PdfReader(io.BytesIO(data))
+# PDFium is not thread-safe; extraction runs in worker threads, so serialize it.
+_PDFIUM_LOCK = threading.Lock()
+
+def _extract_pdf_text(data: bytes, max_chars: int = MAX_RESUME_CHARS) -> str:
     parts: list[str] = []
-    for page in reader.pages[:10]:  # hard cap pages
-        txt = page.extract_text() or ""
-        if txt.strip():
-            parts.append(txt)
+    total = 0
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                txt = textpage.get_text_range().replace("\r\n", "\n").strip()
+                textpage.close()
+                page.close()
+                if not txt:
+                    continue
+                parts.append(txt)
+                total += len(txt) + 2
+                if total >= max_chars:  # rest would be truncated anyway
+                    break
+        finally:
+            pdf.close()
     return "\n\n".join(parts)
 
-def _extract_docx_text(data: bytes) -> str:
+_DOCX_TEXT_NODE = ".//" + qn("w:t")
+
+def _extract_docx_text(data: bytes, max_chars: int = MAX_RESUME_CHARS) -> str:
     doc = docx.Document(io.BytesIO(data))
     parts: list[str] = []
-    for p in doc.paragraphs[:400]:  # cap paragraphs
-        t = (p.text or "").strip()
-        if t:
-            parts.append(t)
+    total = 0
+    for p in doc.paragraphs:
+        # p.text joins every run on access; skip paragraphs with no text nodes outright.
+        if p._p.find(_DOCX_TEXT_NODE) is None:
+            continue
+        t = p.text.strip()
+        if not t:
+            continue
+        parts.append(t)
+        total += len(t) + 1
+        if total >= max_chars:
+            break
     return "\n".join(parts)
 
 
@@ -100,7 +189,7 @@ async def root():
 
 @app.post("/api/upload_resume")
 async def upload_resume(file: UploadFile = File(...)):
-    t0 = time.time()
+    t0 = perf_counter_ns()
     content_type = file.content_type or ""
 
     if content_type not in ALLOWED_RESUME_TYPES:
@@ -109,33 +198,44 @@ async def upload_resume(file: UploadFile = File(...)):
             detail="Unsupported file type. Upload a PDF or DOCX resume.",
         )
 
-    data = await file.read()
+    # Reject on the declared size before touching the body, and never read
+    # more than one byte past the limit in case the size is unknown.
+    if file.size is not None and file.size > MAX_RESUME_BYTES:
+        raise HTTPException(status_code=413, detail="File too large. Max 2MB.")
+    data = await file.read(MAX_RESUME_BYTES + 1)
     if not data or len(data) == 0:
         raise HTTPException(status_code=400, detail="Empty file.")
     if len(data) > MAX_RESUME_BYTES:
         raise HTTPException(status_code=413, detail="File too large. Max 2MB.")
 
-    try:
-        kind = ALLOWED_RESUME_TYPES[content_type]
-        if kind == "pdf":
-            text = _extract_pdf_text(data)
-        else:
-            text = _extract_docx_text(data)
-
-        text = _clean_text(text)
-        if len(text.strip()) < 50:
-            raise HTTPException(
-                status_code=422,
-                detail="Could not extract enough text from this file. Try another PDF/DOCX (non-scanned).",
-            )
-    except HTTPException:
-        raise
-    except Exception:
-        logger.exception("resume extraction failed")
-        raise HTTPException(status_code=422, detail="Failed to parse resume file.")
-
-    dt_ms = int((time.time() - t0) * 1000)
-    logger.info("resume uploaded kind=%s bytes=%s ms=%s", kind, len(data), dt_ms)
+    kind = ALLOWED_RESUME_TYPES[content_type]
+    # Re-uploads of the same file (retries, re-submits) skip parsing entirely.
+    cache_key = (kind, hashlib.blake2b(data, digest_size=16).digest())
+    text = _resume_cache_get(app.state.resume_cache, cache_key)
+    cached = text is not None
+
+    if text is None:
+        try:
+            if kind == "pdf":
+                text = await asyncio.to_thread(_extract_pdf_text, data)
+            else:
+                text = await asyncio.to_thread(_extract_docx_text, data)
+
+            text = _clean_text(text)
+            if len(text.strip()) < 50:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Could not extract enough text from this file. Try another PDF/DOCX (non-scanned).",
+                )
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("resume extraction failed")
+            raise HTTPException(status_code=422, detail="Failed to parse resume file.")
+        _resume_cache_put(app.state.resume_cache, cache_key, text)
+
+    dt_ms = (perf_counter_ns() - t0) // 1_000_000
+    logger.info("resume uploaded kind=%s bytes=%s cached=%s ms=%s", kind, len(data), cached, dt_ms)
 
     return {
         "ok": True,
@@ -150,21 +250,66 @@ async def health():
     return {"ok": True}
 
 
-@app.post("/api/chat", response_model=AgentResponse)
-async def chat(req: ChatRequest, request: Request):
-    t0 = time.time()
-    request_id = request.headers.get("x-vercel-id") or request.headers.get("x-request-id")
-
+def _check_chat_request(req: ChatRequest) -> None:
     # Basic sanity checks
     if req.messages[-1].role != "user":
         raise HTTPException(status_code=400, detail="Last message must be role='user'.")
 
     # Lightweight anti-abuse: reject absurd payloads
-    total_chars = sum(len(m.content) for m in req.messages)
-    if total_chars > 24000:
-        raise HTTPException(status_code=413, detail="Message history too large. Keep it shorter.")
+    total_chars = 0
+    for m in req.messages:
+        total_chars += len(m.content)
+        if total_chars > 24000:
+            raise HTTPException(status_code=413, detail="Message history too large. Keep it shorter.")
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def _chat_event_stream(orch: Orchestrator, req: ChatRequest, request_id: str | None, t0: int):
+    try:
+        async for kind, payload in orch.respond_stream(req.messages, req.mode):
+            if kind == "done":
+                yield _sse("done", payload.model_dump_json())
+            elif kind == "warning":
+                yield _sse("warning", json.dumps({"warning": payload}))
+            else:
+                yield _sse(kind, json.dumps({"reply_markdown": payload}))
+    except Exception:
+        # Headers are already sent, so report the failure in-band.
+        logger.exception("chat stream failed request_id=%s", request_id)
+        yield _sse(
+            "error",
+            ApiError(
+                error="provider_error",
+                detail="Model/provider error. Try again.",
+                request_id=request_id,
+            ).model_dump_json(),
+        )
+        return
+
+    dt_ms = (perf_counter_ns() - t0) // 1_000_000
+    logger.info("chat stream ok request_id=%s mode=%s ms=%s", request_id, req.mode, dt_ms)
+
+
+@app.post("/api/chat", response_model=AgentResponse)
+async def chat(req: ChatRequest, request: Request):
+    t0 = perf_counter_ns()
+    request_id = request.headers.get("x-vercel-id") or request.headers.get("x-request-id")
+
+    _check_chat_request(req)
+    orch = _get_orchestrator()
+
+    # Clients that accept SSE get partial responses as they are generated;
+    # everyone else keeps the buffered JSON response.
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _chat_event_stream(orch, req, request_id, t0),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
-    orch = app.state.orchestrator
     try:
         out = await orch.respond(req.messages, req.mode)
     except ValueError as e:
@@ -173,9 +318,46 @@ async def chat(req: ChatRequest, request: Request):
         logger.exception("chat failed request_id=%s", request_id)
         raise HTTPException(status_code=502, detail="Model/provider error. Try again.") from e
 
-    dt_ms = int((time.time() - t0) * 1000)
+    dt_ms = (perf_counter_ns() - t0) // 1_000_000
     logger.info("chat ok request_id=%s mode=%s ms=%s", request_id, req.mode, dt_ms)
     return out
+
+
+@app.post("/api/chat_batch", response_model=list[AgentResponse | ApiError])
+async def chat_batch(batch: ChatBatchRequest, request: Request):
+    """Run several chat requests concurrently (for evals and offline runs).
+
+    Results come back in input order. Each item is either an AgentResponse or
+    an ApiError; one item failing (bad input, provider error, rate limit after
+    retries) does not fail the batch. At most CHAT_BATCH_CONCURRENCY model calls
+    are in flight at once across the whole batch. An auto-mode item can make
+    two calls (intent + main) and a retry or fallback makes more, so a batch
+    costs at least N requests against provider rate limits.
+    """
+    t0 = perf_counter_ns()
+    request_id = request.headers.get("x-vercel-id") or request.headers.get("x-request-id")
+    orch = _get_orchestrator()
+
+    async def run_one(req: ChatRequest) -> AgentResponse | ApiError:
+        try:
+            _check_chat_request(req)
+            return await orch.respond(req.messages, req.mode)
+        except HTTPException as e:
+            return ApiError(error="bad_request", detail=e.detail, request_id=request_id)
+        except ValueError as e:
+            return ApiError(error="bad_request", detail=str(e), request_id=request_id)
+        except Exception:
+            logger.exception("chat batch item failed request_id=%s", request_id)
+            return ApiError(error="provider_error", detail="Model/provider error. Try again.", request_id=request_id)
+
+    # The cap is applied around each upstream call, not per item.
+    with limit_upstream_calls(CHAT_BATCH_CONCURRENCY):
+        out = await asyncio.gather(*(run_one(req) for req in batch.items))
+
+    dt_ms = (perf_counter_ns() - t0) // 1_000_000
+    failed = sum(isinstance(r, ApiError) for r in out)
+    logger.info("chat batch ok request_id=%s items=%s failed=%s ms=%s", request_id, len(out), failed, dt_ms)
+    return out
 from fastapi.staticfiles import StaticFiles
 if os.getenv("VERCEL") != "1":
     app.mount("/", StaticFiles(directory="public", html=True), name="static")
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -31,3 +33,9 @@ class Settings(BaseSettings):
     # Optional attribution headers for OpenRouter leaderboards
     site_url: str | None = Field(None, alias="OPENROUTER_SITE_URL")
     app_name: str | None = Field("PlacementSprint", alias="OPENROUTER_APP_NAME")
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    # Parsed once per process; warm serverless invocations reuse it.
+    return Settings()